@@ -6,12 +6,12 @@
 
 from __future__ import annotations
 
-import abc
-from collections import Counter
 from collections.abc import Mapping, Sequence
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime
 from enum import auto, Enum
+from heapq import nlargest
+from operator import attrgetter, itemgetter
 from typing import Final, Literal, TypedDict
 from uuid import UUID
 
@@ -41,23 +41,27 @@ class RawLicenseUsageReport(TypedDict):
 #   '----------------------------------------------------------------------'
 
 
-_SUBSCRIPTION_LIMITS_FIXED = (
-    "3000",
-    "7000",
-    "12000",
-    "18000",
-    "30000",
-    "60000",
-    "100000",
-    "200000",
-    "300000",
-    "500000",
-    "1000000",
-    "1500000",
-    "2000000",
-    "2000000+",
+_SUBSCRIPTION_LIMITS_FIXED: Final = frozenset(
+    {
+        "3000",
+        "7000",
+        "12000",
+        "18000",
+        "30000",
+        "60000",
+        "100000",
+        "200000",
+        "300000",
+        "500000",
+        "1000000",
+        "1500000",
+        "2000000",
+        "2000000+",
+    }
 )
 
+_UNLIMITED_MARKERS: Final = frozenset({"2000000+", "unlimited"})
+
 
 class SubscriptionDetailsLimitType(Enum):
     fixed = auto()
@@ -66,17 +70,20 @@ class SubscriptionDetailsLimitType(Enum):
 
     @classmethod
     def parse(cls, raw_subscription_details_limit_type: str) -> SubscriptionDetailsLimitType:
-        match raw_subscription_details_limit_type:
-            case "fixed":
-                return SubscriptionDetailsLimitType.fixed
-            case "unlimited":
-                return SubscriptionDetailsLimitType.unlimited
-            case "custom":
-                return SubscriptionDetailsLimitType.custom
-        raise ValueError(raw_subscription_details_limit_type)
+        try:
+            return _LIMIT_TYPE_BY_NAME[raw_subscription_details_limit_type]
+        except KeyError as e:
+            raise ValueError(raw_subscription_details_limit_type) from e
+
 
+_LIMIT_TYPE_BY_NAME: Final[Mapping[str, SubscriptionDetailsLimitType]] = {
+    "fixed": SubscriptionDetailsLimitType.fixed,
+    "unlimited": SubscriptionDetailsLimitType.unlimited,
+    "custom": SubscriptionDetailsLimitType.custom,
+}
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class SubscriptionDetailsLimit:
     type_: SubscriptionDetailsLimitType
     value: int
@@ -103,19 +110,11 @@ class SubscriptionDetailsLimit:
 
     @classmethod
     def _parse(cls, raw_type: str, raw_value: str | int | float) -> SubscriptionDetailsLimit:
-        if raw_type in ["2000000+", "unlimited"] or int(raw_value) == -1:
-            return SubscriptionDetailsLimit(
-                type_=SubscriptionDetailsLimitType.unlimited,
-                # '-1' means unlimited. This value is also used in Django DB
-                # where we have no appropriate 'float("inf")' DB field.
-                value=-1,
-            )
+        if raw_type in _UNLIMITED_MARKERS or int(raw_value) == -1:
+            return _UNLIMITED_LIMIT
 
-        if str(raw_value) in _SUBSCRIPTION_LIMITS_FIXED:
-            return SubscriptionDetailsLimit(
-                type_=SubscriptionDetailsLimitType.fixed,
-                value=int(raw_value),
-            )
+        if (fixed_limit := _FIXED_LIMITS.get(str(raw_value))) is not None:
+            return fixed_limit
 
         return SubscriptionDetailsLimit(
             type_=SubscriptionDetailsLimitType.custom,
@@ -123,6 +122,24 @@ class SubscriptionDetailsLimit:
         )
 
 
+# Limits are immutable, so the unlimited and the fixed ones are shared.
+_UNLIMITED_LIMIT: Final = SubscriptionDetailsLimit(
+    type_=SubscriptionDetailsLimitType.unlimited,
+    # '-1' means unlimited. This value is also used in Django DB
+    # where we have no appropriate 'float("inf")' DB field.
+    value=-1,
+)
+
+_FIXED_LIMITS: Final[Mapping[str, SubscriptionDetailsLimit]] = {
+    raw_value: SubscriptionDetailsLimit(
+        type_=SubscriptionDetailsLimitType.fixed,
+        value=int(raw_value),
+    )
+    for raw_value in _SUBSCRIPTION_LIMITS_FIXED
+    if raw_value not in _UNLIMITED_MARKERS
+}
+
+
 class RawSubscriptionDetails(TypedDict):
     subscription_start: int
     subscription_end: int
@@ -135,25 +152,25 @@ class RawSubscriptionDetailsForConfig(TypedDict):
     subscription_limit: str | tuple[str, int]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SubscriptionDetails:
     start: int
     end: int
     limit: SubscriptionDetailsLimit
 
     def for_report(self) -> RawSubscriptionDetails:
-        return RawSubscriptionDetails(
-            subscription_start=self.start,
-            subscription_end=self.end,
-            subscription_limit=self.limit.for_report(),
-        )
+        return {
+            "subscription_start": self.start,
+            "subscription_end": self.end,
+            "subscription_limit": self.limit.for_report(),
+        }
 
     def for_config(self) -> RawSubscriptionDetailsForConfig:
-        return RawSubscriptionDetailsForConfig(
-            subscription_start=self.start,
-            subscription_end=self.end,
-            subscription_limit=self.limit.for_config(),
-        )
+        return {
+            "subscription_start": self.start,
+            "subscription_end": self.end,
+            "subscription_limit": self.limit.for_config(),
+        }
 
 
 # .
@@ -171,7 +188,10 @@ class RawLicenseUsageExtensions(TypedDict):
     ntop: bool
 
 
-@dataclass(frozen=True)
+_EMPTY_EXTENSIONS: Final[Mapping[str, bool]] = {}
+
+
+@dataclass(frozen=True, slots=True)
 class LicenseUsageExtensions:
     ntop: bool
 
@@ -196,12 +216,9 @@ class LicenseUsageExtensions:
         if not isinstance(raw_sample, dict):
             raise TypeError("Wrong sample type: %r" % type(raw_sample))
 
-        parsed_extensions = {
-            ext_key: raw_sample.get(ext_key, raw_sample.get("extensions", {}).get(key, False))
-            for key in ["ntop"]
-            for ext_key in (f"extension_{key}",)
-        }
-        return cls(ntop=parsed_extensions["extension_ntop"])
+        if (ntop := raw_sample.get("extension_ntop")) is None:
+            ntop = raw_sample.get("extensions", _EMPTY_EXTENSIONS).get("ntop", False)
+        return cls(ntop=bool(ntop))
 
 
 class RawLicenseUsageSample(TypedDict):
@@ -226,7 +243,7 @@ class RawLicenseUsageSample(TypedDict):
     extension_ntop: bool
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class LicenseUsageSample:
     instance_id: UUID | None
     site_hash: str
@@ -249,27 +266,27 @@ class LicenseUsageSample:
     extension_ntop: bool
 
     def for_report(self) -> RawLicenseUsageSample:
-        return RawLicenseUsageSample(
-            instance_id=None if self.instance_id is None else str(self.instance_id),
-            site_hash=self.site_hash,
-            version=self.version,
-            edition=self.edition,
-            platform=self.platform,
-            is_cma=self.is_cma,
-            sample_time=self.sample_time,
-            timezone=self.timezone,
-            num_hosts=self.num_hosts,
-            num_hosts_cloud=self.num_hosts_cloud,
-            num_hosts_shadow=self.num_hosts_shadow,
-            num_hosts_excluded=self.num_hosts_excluded,
-            num_services=self.num_services,
-            num_services_cloud=self.num_services_cloud,
-            num_services_shadow=self.num_services_shadow,
-            num_services_excluded=self.num_services_excluded,
-            num_synthetic_tests=self.num_synthetic_tests,
-            num_synthetic_tests_excluded=self.num_synthetic_tests_excluded,
-            extension_ntop=self.extension_ntop,
-        )
+        return {
+            "instance_id": None if self.instance_id is None else str(self.instance_id),
+            "site_hash": self.site_hash,
+            "version": self.version,
+            "edition": self.edition,
+            "platform": self.platform,
+            "is_cma": self.is_cma,
+            "sample_time": self.sample_time,
+            "timezone": self.timezone,
+            "num_hosts": self.num_hosts,
+            "num_hosts_cloud": self.num_hosts_cloud,
+            "num_hosts_shadow": self.num_hosts_shadow,
+            "num_hosts_excluded": self.num_hosts_excluded,
+            "num_services": self.num_services,
+            "num_services_cloud": self.num_services_cloud,
+            "num_services_shadow": self.num_services_shadow,
+            "num_services_excluded": self.num_services_excluded,
+            "num_synthetic_tests": self.num_synthetic_tests,
+            "num_synthetic_tests_excluded": self.num_synthetic_tests_excluded,
+            "extension_ntop": self.extension_ntop,
+        }
 
 
 # .
@@ -307,48 +324,33 @@ def _parse_subscription_details(raw: object) -> SubscriptionDetails:
 
 def _parse_platform(platform: str) -> str:
     # Restrict platform string to 50 chars due to the restriction of the license DB field.
-    return platform[:50]
+    return platform if len(platform) <= 50 else platform[:50]
 
 
-def _parse_sample_v1_1(instance_id: UUID | None, site_hash: str, raw: object) -> LicenseUsageSample:
-    if not isinstance(raw, dict):
-        raise TypeError("Parse sample 1.1/1.2/1.3: Wrong sample type: %r" % type(raw))
-    if not (site_hash := raw.get("site_hash", site_hash)):
-        raise ValueError("Parse sample 1.1/1.2/1.3: No such site hash")
-    extensions = LicenseUsageExtensions.parse_from_sample(raw)
-    return LicenseUsageSample(
-        instance_id=instance_id,
-        site_hash=site_hash,
-        version=raw["version"],
-        edition=raw["edition"],
-        platform=_parse_platform(raw["platform"]),
-        is_cma=raw["is_cma"],
-        sample_time=raw["sample_time"],
-        timezone=raw["timezone"],
-        num_hosts=raw["num_hosts"],
-        num_hosts_cloud=0,
-        num_hosts_shadow=0,
-        num_hosts_excluded=raw["num_hosts_excluded"],
-        num_services=raw["num_services"],
-        num_services_cloud=0,
-        num_services_shadow=0,
-        num_services_excluded=raw["num_services_excluded"],
-        num_synthetic_tests=0,
-        num_synthetic_tests_excluded=0,
-        extension_ntop=extensions.ntop,
-    )
+@dataclass(frozen=True, slots=True)
+class _SampleSchema:
+    label: str
+    needs_instance_id: bool
+    shadow_host_key: str | None
+    has_cloud: bool
+    has_service_shadow: bool
+    has_excluded: bool
+    has_synthetic: bool
 
 
-def _parse_sample_v2_0(instance_id: UUID | None, site_hash: str, raw: object) -> LicenseUsageSample:
+def _parse_sample(
+    schema: _SampleSchema, instance_id: UUID | None, site_hash: str, raw: object
+) -> LicenseUsageSample:
     if not isinstance(raw, dict):
-        raise TypeError("Parse sample 2.0/2.1: Wrong sample type: %r" % type(raw))
-    if not (raw_instance_id := raw.get("instance_id")):
-        raise ValueError("Parse sample 2.0/2.1: No such instance ID")
+        raise TypeError("Parse sample %s: Wrong sample type: %r" % (schema.label, type(raw)))
+    raw_instance_id = None
+    if schema.needs_instance_id and not (raw_instance_id := raw.get("instance_id")):
+        raise ValueError("Parse sample %s: No such instance ID" % schema.label)
     if not (site_hash := raw.get("site_hash", site_hash)):
-        raise ValueError("Parse sample 2.0/2.1: No such site hash")
+        raise ValueError("Parse sample %s: No such site hash" % schema.label)
     extensions = LicenseUsageExtensions.parse_from_sample(raw)
     return LicenseUsageSample(
-        instance_id=UUID(raw_instance_id),
+        instance_id=instance_id if raw_instance_id is None else UUID(raw_instance_id),
         site_hash=site_hash,
         version=raw["version"],
         edition=raw["edition"],
@@ -357,221 +359,104 @@ def _parse_sample_v2_0(instance_id: UUID | None, site_hash: str, raw: object) ->
         sample_time=raw["sample_time"],
         timezone=raw["timezone"],
         num_hosts=raw["num_hosts"],
-        num_hosts_cloud=raw["num_hosts_cloud"],
-        num_hosts_shadow=raw["num_hosts_shadow"],
-        num_hosts_excluded=raw["num_hosts_excluded"],
+        num_hosts_cloud=raw["num_hosts_cloud"] if schema.has_cloud else 0,
+        num_hosts_shadow=raw[schema.shadow_host_key] if schema.shadow_host_key else 0,
+        num_hosts_excluded=raw["num_hosts_excluded"] if schema.has_excluded else 0,
         num_services=raw["num_services"],
-        num_services_cloud=raw["num_services_cloud"],
-        num_services_shadow=raw["num_services_shadow"],
-        num_services_excluded=raw["num_services_excluded"],
-        num_synthetic_tests=0,
-        num_synthetic_tests_excluded=0,
+        num_services_cloud=raw["num_services_cloud"] if schema.has_cloud else 0,
+        num_services_shadow=raw["num_services_shadow"] if schema.has_service_shadow else 0,
+        num_services_excluded=raw["num_services_excluded"] if schema.has_excluded else 0,
+        num_synthetic_tests=raw["num_synthetic_tests"] if schema.has_synthetic else 0,
+        num_synthetic_tests_excluded=(
+            raw["num_synthetic_tests_excluded"] if schema.has_synthetic else 0
+        ),
         extension_ntop=extensions.ntop,
     )
 
 
-class Parser:
-    @abc.abstractmethod
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails: ...
-
-    @abc.abstractmethod
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample: ...
-
-
-class ParserV1_0(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
-
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        if not isinstance(raw, dict):
-            raise TypeError("Parse sample 1.0: Wrong sample type: %r" % type(raw))
-        if not (site_hash := raw.get("site_hash", site_hash)):
-            raise ValueError("Parse sample 1.0: No such site hash")
-        extensions = LicenseUsageExtensions.parse_from_sample(raw)
-        return LicenseUsageSample(
-            instance_id=instance_id,
-            site_hash=site_hash,
-            version=raw["version"],
-            edition=raw["edition"],
-            platform=_parse_platform(raw["platform"]),
-            is_cma=raw["is_cma"],
-            sample_time=raw["sample_time"],
-            timezone=raw["timezone"],
-            num_hosts=raw["num_hosts"],
-            num_hosts_cloud=0,
-            num_hosts_shadow=0,
-            num_hosts_excluded=0,
-            num_services=raw["num_services"],
-            num_services_cloud=0,
-            num_services_shadow=0,
-            num_services_excluded=0,
-            num_synthetic_tests=0,
-            num_synthetic_tests_excluded=0,
-            extension_ntop=extensions.ntop,
-        )
-
-
-class ParserV1_1(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
-
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        return _parse_sample_v1_1(instance_id, site_hash, raw)
-
-
-class ParserV1_2(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
-
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        return _parse_sample_v1_1(instance_id, site_hash, raw)
-
-
-class ParserV1_3(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
-
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        return _parse_sample_v1_1(instance_id, site_hash, raw)
-
-
-class ParserV1_4(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
-
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        if not isinstance(raw, dict):
-            raise TypeError("Parse sample 1.4: Wrong sample type: %r" % type(raw))
-        if not (site_hash := raw.get("site_hash", site_hash)):
-            raise ValueError("Parse sample 1.4: No such site hash")
-        extensions = LicenseUsageExtensions.parse_from_sample(raw)
-        return LicenseUsageSample(
-            instance_id=instance_id,
-            site_hash=site_hash,
-            version=raw["version"],
-            edition=raw["edition"],
-            platform=_parse_platform(raw["platform"]),
-            is_cma=raw["is_cma"],
-            sample_time=raw["sample_time"],
-            timezone=raw["timezone"],
-            num_hosts=raw["num_hosts"],
-            num_hosts_cloud=0,
-            num_hosts_shadow=raw["num_shadow_hosts"],
-            num_hosts_excluded=raw["num_hosts_excluded"],
-            num_services=raw["num_services"],
-            num_services_cloud=0,
-            num_services_shadow=0,
-            num_services_excluded=raw["num_services_excluded"],
-            num_synthetic_tests=0,
-            num_synthetic_tests_excluded=0,
-            extension_ntop=extensions.ntop,
-        )
-
-
-class ParserV1_5(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
+_SAMPLE_SCHEMA_V1_1: Final = _SampleSchema(
+    label="1.1/1.2/1.3",
+    needs_instance_id=False,
+    shadow_host_key=None,
+    has_cloud=False,
+    has_service_shadow=False,
+    has_excluded=True,
+    has_synthetic=False,
+)
 
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        if not isinstance(raw, dict):
-            raise TypeError("Parse sample 1.5: Wrong sample type: %r" % type(raw))
-        if not (raw_instance_id := raw.get("instance_id")):
-            raise ValueError("Parse sample 1.5: No such instance ID")
-        if not (site_hash := raw.get("site_hash", site_hash)):
-            raise ValueError("Parse sample 1.5: No such site hash")
-        extensions = LicenseUsageExtensions.parse_from_sample(raw)
-        return LicenseUsageSample(
-            instance_id=UUID(raw_instance_id),
-            site_hash=site_hash,
-            version=raw["version"],
-            edition=raw["edition"],
-            platform=_parse_platform(raw["platform"]),
-            is_cma=raw["is_cma"],
-            sample_time=raw["sample_time"],
-            timezone=raw["timezone"],
-            num_hosts=raw["num_hosts"],
-            num_hosts_cloud=0,
-            num_hosts_shadow=raw["num_shadow_hosts"],
-            num_hosts_excluded=raw["num_hosts_excluded"],
-            num_services=raw["num_services"],
-            num_services_cloud=0,
-            num_services_shadow=0,
-            num_services_excluded=raw["num_services_excluded"],
-            num_synthetic_tests=0,
-            num_synthetic_tests_excluded=0,
-            extension_ntop=extensions.ntop,
-        )
+_SAMPLE_SCHEMA_V2_0: Final = _SampleSchema(
+    label="2.0/2.1",
+    needs_instance_id=True,
+    shadow_host_key="num_hosts_shadow",
+    has_cloud=True,
+    has_service_shadow=True,
+    has_excluded=True,
+    has_synthetic=False,
+)
 
+_SAMPLE_SCHEMAS: Final[Mapping[str, _SampleSchema]] = {
+    "1.0": _SampleSchema(
+        label="1.0",
+        needs_instance_id=False,
+        shadow_host_key=None,
+        has_cloud=False,
+        has_service_shadow=False,
+        has_excluded=False,
+        has_synthetic=False,
+    ),
+    "1.1": _SAMPLE_SCHEMA_V1_1,
+    "1.2": _SAMPLE_SCHEMA_V1_1,
+    "1.3": _SAMPLE_SCHEMA_V1_1,
+    "1.4": _SampleSchema(
+        label="1.4",
+        needs_instance_id=False,
+        shadow_host_key="num_shadow_hosts",
+        has_cloud=False,
+        has_service_shadow=False,
+        has_excluded=True,
+        has_synthetic=False,
+    ),
+    "1.5": _SampleSchema(
+        label="1.5",
+        needs_instance_id=True,
+        shadow_host_key="num_shadow_hosts",
+        has_cloud=False,
+        has_service_shadow=False,
+        has_excluded=True,
+        has_synthetic=False,
+    ),
+    "2.0": _SAMPLE_SCHEMA_V2_0,
+    "2.1": _SAMPLE_SCHEMA_V2_0,
+    "3.0": _SampleSchema(
+        label="3.0",
+        needs_instance_id=True,
+        shadow_host_key="num_hosts_shadow",
+        has_cloud=True,
+        has_service_shadow=True,
+        has_excluded=True,
+        has_synthetic=True,
+    ),
+}
 
-class ParserV2_0(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
 
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        return _parse_sample_v2_0(instance_id, site_hash, raw)
+class Parser:
+    __slots__ = ("_schema",)
 
+    def __init__(self, schema: _SampleSchema) -> None:
+        self._schema = schema
 
-class ParserV2_1(Parser):
     def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
         return _parse_subscription_details(raw)
 
     def parse_sample(
         self, instance_id: UUID | None, site_hash: str, raw: object
     ) -> LicenseUsageSample:
-        return _parse_sample_v2_0(instance_id, site_hash, raw)
-
+        return _parse_sample(self._schema, instance_id, site_hash, raw)
 
-class ParserV3_0(Parser):
-    def parse_subscription_details(self, raw: object) -> SubscriptionDetails:
-        return _parse_subscription_details(raw)
 
-    def parse_sample(
-        self, instance_id: UUID | None, site_hash: str, raw: object
-    ) -> LicenseUsageSample:
-        if not isinstance(raw, dict):
-            raise TypeError("Parse sample 3.0: Wrong sample type: %r" % type(raw))
-        if not (raw_instance_id := raw.get("instance_id")):
-            raise ValueError("Parse sample 3.0: No such instance ID")
-        if not (site_hash := raw.get("site_hash", site_hash)):
-            raise ValueError("Parse sample 3.0: No such site hash")
-        extensions = LicenseUsageExtensions.parse_from_sample(raw)
-        return LicenseUsageSample(
-            instance_id=UUID(raw_instance_id),
-            site_hash=site_hash,
-            version=raw["version"],
-            edition=raw["edition"],
-            platform=_parse_platform(raw["platform"]),
-            is_cma=raw["is_cma"],
-            sample_time=raw["sample_time"],
-            timezone=raw["timezone"],
-            num_hosts=raw["num_hosts"],
-            num_hosts_cloud=raw["num_hosts_cloud"],
-            num_hosts_shadow=raw["num_hosts_shadow"],
-            num_hosts_excluded=raw["num_hosts_excluded"],
-            num_services=raw["num_services"],
-            num_services_cloud=raw["num_services_cloud"],
-            num_services_shadow=raw["num_services_shadow"],
-            num_services_excluded=raw["num_services_excluded"],
-            num_synthetic_tests=raw["num_synthetic_tests"],
-            num_synthetic_tests_excluded=raw["num_synthetic_tests_excluded"],
-            extension_ntop=extensions.ntop,
-        )
+_KNOWN_PROTOCOL_VERSIONS: Final[frozenset[str]] = frozenset(
+    {"1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"}
+)
 
 
 def parse_protocol_version(
@@ -581,50 +466,21 @@ def parse_protocol_version(
         raise TypeError(raw)
     if not isinstance(raw_protocol_version := raw.get("VERSION"), str):
         raise TypeError(raw_protocol_version)
-    match raw_protocol_version:
-        case "1.0":
-            return "1.0"
-        case "1.1":
-            return "1.1"
-        case "1.2":
-            return "1.2"
-        case "1.3":
-            return "1.3"
-        case "1.4":
-            return "1.4"
-        case "1.5":
-            return "1.5"
-        case "2.0":
-            return "2.0"
-        case "2.1":
-            return "2.1"
-        case "3.0":
-            return "3.0"
+    if raw_protocol_version in _KNOWN_PROTOCOL_VERSIONS:
+        return raw_protocol_version  # type: ignore[return-value]
     raise ValueError(f"Unknown protocol version: {raw_protocol_version!r}")
 
 
+_PARSERS: Final[Mapping[str, Parser]] = {
+    protocol_version: Parser(schema) for protocol_version, schema in _SAMPLE_SCHEMAS.items()
+}
+
+
 def make_parser(
     protocol_version: Literal["1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"]
 ) -> Parser:
-    match protocol_version:
-        case "1.0":
-            return ParserV1_0()
-        case "1.1":
-            return ParserV1_1()
-        case "1.2":
-            return ParserV1_2()
-        case "1.3":
-            return ParserV1_3()
-        case "1.4":
-            return ParserV1_4()
-        case "1.5":
-            return ParserV1_5()
-        case "2.0":
-            return ParserV2_0()
-        case "2.1":
-            return ParserV2_1()
-        case "3.0":
-            return ParserV3_0()
+    # Parsers are stateless, so the instances can be shared.
+    return _PARSERS[protocol_version]
 
 
 # .
@@ -644,7 +500,7 @@ class RawSubscriptionDetailsForAggregation(TypedDict):
     limit: Literal["unlimited"] | int | None
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SubscriptionDetailsForAggregation:
     start: int | None
     end: int | None
@@ -667,14 +523,14 @@ class SubscriptionDetailsForAggregation:
         return None
 
     def for_report(self) -> RawSubscriptionDetailsForAggregation:
-        return RawSubscriptionDetailsForAggregation(
-            start=self.start,
-            end=self.end,
-            limit=self.limit[1] if isinstance(self.limit, tuple) else self.limit,
-        )
+        return {
+            "start": self.start,
+            "end": self.end,
+            "limit": self.limit[1] if isinstance(self.limit, tuple) else self.limit,
+        }
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MonthlyServiceAverage:
     sample_date: datetime
     num_services: float
@@ -696,9 +552,16 @@ class RawMonthlyServiceAggregation(TypedDict):
     subscription_exceeded_first: Mapping[str, float] | None
 
 
-class MonthlyServiceAverages:
-    today = datetime.today()
+_ONE_MONTH: Final = relativedelta(months=+1)
+_NUM_SERVICES: Final = attrgetter("num_services")
+
+
+def _floor_to_day(timestamp: int) -> datetime:
+    day = date.fromtimestamp(timestamp)
+    return datetime(day.year, day.month, day.day)
+
 
+class MonthlyServiceAverages:
     def __init__(
         self,
         subscription_details: SubscriptionDetailsForAggregation,
@@ -712,21 +575,20 @@ class MonthlyServiceAverages:
     def _calculate_daily_services(
         short_samples: Sequence[tuple[int, int]]
     ) -> Sequence[MonthlyServiceAverage]:
-        daily_services: dict[datetime, Counter[str]] = {}
+        daily_services: dict[date, int] = {}
         for sample_time, num_services in short_samples:
-            sample_date = datetime.fromtimestamp(sample_time)
-            daily_services.setdefault(
-                datetime(sample_date.year, sample_date.month, sample_date.day),
-                Counter(),
-            ).update(num_services=num_services)
+            sample_day = date.fromtimestamp(sample_time)
+            daily_services[sample_day] = daily_services.get(sample_day, 0) + num_services
 
         return [
             MonthlyServiceAverage(
-                sample_date=sample_date,
-                num_services=counter["num_services"],
+                sample_date=datetime(sample_day.year, sample_day.month, sample_day.day),
+                num_services=num_services,
             )
             # License usage history per site (recorded in Checkmk) is max. 400 long.
-            for sample_date, counter in sorted(daily_services.items())[-400:]
+            for sample_day, num_services in sorted(
+                nlargest(400, daily_services.items(), key=itemgetter(0))
+            )
         ]
 
     def get_aggregation(self) -> RawMonthlyServiceAggregation:
@@ -750,41 +612,36 @@ class MonthlyServiceAverages:
             # start or end.
             return
 
-        monthly_services: dict[datetime, Counter[str]] = {}
-        month_start = datetime.fromtimestamp(self._subscription_details.start).replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0,
-        )
-        month_end = month_start + relativedelta(months=+1)
-        subscription_end_date = datetime.fromtimestamp(self._subscription_details.end).replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0,
-        )
+        # Per month: sum of the daily number of services and number of days
+        sums: dict[datetime, int] = {}
+        counts: dict[datetime, int] = {}
+        month_start = _floor_to_day(self._subscription_details.start)
+        month_end = month_start + _ONE_MONTH
+        subscription_end_date = _floor_to_day(self._subscription_details.end)
+
+        # Skip last, incomplete month (subscription_end_date excl.). This only depends on
+        # month_end, so it is checked initially and whenever month_end moves, not per day.
+        today = datetime.now()
+        if month_end >= today or month_end > subscription_end_date:
+            return
 
         for daily_service in self._daily_services:
-            if daily_service.sample_date >= month_end:
+            sample_date = daily_service.sample_date
+            if sample_date >= month_end:
                 month_start = month_end
-                month_end = month_start + relativedelta(months=+1)
-
-            if month_end >= MonthlyServiceAverages.today or month_end > subscription_end_date:
-                # Skip last, incomplete month (subscription_end_date excl.)
-                break
+                month_end = month_start + _ONE_MONTH
+                if month_end >= today or month_end > subscription_end_date:
+                    break
 
-            if month_start <= daily_service.sample_date < month_end:
-                monthly_services.setdefault(month_start, Counter()).update(
-                    num_daily_services=1,
-                    num_services=int(daily_service.num_services),
-                )
+            if month_start <= sample_date < month_end:
+                sums[month_start] = sums.get(month_start, 0) + int(daily_service.num_services)
+                counts[month_start] = counts.get(month_start, 0) + 1
 
-        for month_start, counter in monthly_services.items():
+        for month_start, num_services in sums.items():
             self._monthly_service_averages.append(
                 MonthlyServiceAverage(
                     sample_date=month_start,
-                    num_services=1.0 * counter["num_services"] / counter["num_daily_services"],
+                    num_services=num_services / counts[month_start],
                 )
             )
 
@@ -796,7 +653,7 @@ class MonthlyServiceAverages:
     def _get_highest_service_report(self) -> Mapping[str, float] | None:
         if not self._monthly_service_averages:
             return None
-        return max(self._monthly_service_averages, key=lambda d: d.num_services).for_report()
+        return max(self._monthly_service_averages, key=_NUM_SERVICES).for_report()
 
     def _get_subscription_exceeded_first(self) -> Mapping[str, float] | None:
         if self._subscription_details.real_limit is None:
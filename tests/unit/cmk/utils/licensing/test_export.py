@@ -4,13 +4,19 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 from collections.abc import Mapping
+from datetime import date, datetime, timedelta
 from typing import Any, Literal
+from uuid import UUID
+from zoneinfo import ZoneInfo
 
 import pytest
+import time_machine
 
 from cmk.utils.licensing.export import (
     LicenseUsageExtensions,
     make_parser,
+    MonthlyServiceAverages,
+    parse_protocol_version,
     RawSubscriptionDetailsForAggregation,
     SubscriptionDetails,
     SubscriptionDetailsForAggregation,
@@ -19,6 +25,34 @@ from cmk.utils.licensing.export import (
 )
 
 
+@pytest.mark.parametrize(
+    "protocol_version", ["1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"]
+)
+def test_parse_protocol_version(
+    protocol_version: Literal["1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"]
+) -> None:
+    assert parse_protocol_version({"VERSION": protocol_version, "history": []}) == protocol_version
+
+
+@pytest.mark.parametrize("raw_protocol_version", ["", "0.9", "3.1", "3"])
+def test_parse_protocol_version_unknown(raw_protocol_version: str) -> None:
+    with pytest.raises(ValueError):
+        parse_protocol_version({"VERSION": raw_protocol_version})
+
+
+@pytest.mark.parametrize(
+    "raw_report",
+    [
+        pytest.param([], id="no-dict"),
+        pytest.param({}, id="no-version"),
+        pytest.param({"VERSION": 3.0}, id="version-no-str"),
+    ],
+)
+def test_parse_protocol_version_broken(raw_report: object) -> None:
+    with pytest.raises(TypeError):
+        parse_protocol_version(raw_report)
+
+
 @pytest.mark.parametrize(
     "protocol_version", ["1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"]
 )
@@ -299,6 +333,163 @@ def test_subscription_details_for_config(
     assert subscription_details.for_config() == expected_raw_subscription_details
 
 
+_INSTANCE_ID = UUID("4b66f726-c4fc-454b-80a6-4917d1b386ce")
+_RAW_INSTANCE_ID = "937495cb-78f7-40d4-9b5f-f2c5a81e66b8"
+
+_RAW_SAMPLE_V1_0 = {
+    "site_hash": "site-hash",
+    "version": "version",
+    "edition": "edition",
+    "platform": "platform",
+    "is_cma": False,
+    "sample_time": 1,
+    "timezone": "timezone",
+    "num_hosts": 2,
+    "num_services": 3,
+    "extension_ntop": True,
+}
+_RAW_SAMPLE_V1_1 = {
+    **_RAW_SAMPLE_V1_0,
+    "num_hosts_excluded": 4,
+    "num_services_excluded": 5,
+}
+_RAW_SAMPLE_V1_4 = {
+    **_RAW_SAMPLE_V1_1,
+    "num_shadow_hosts": 6,
+}
+_RAW_SAMPLE_V1_5 = {
+    **_RAW_SAMPLE_V1_4,
+    "instance_id": _RAW_INSTANCE_ID,
+}
+_RAW_SAMPLE_V2_0 = {
+    **_RAW_SAMPLE_V1_1,
+    "instance_id": _RAW_INSTANCE_ID,
+    "num_hosts_cloud": 7,
+    "num_hosts_shadow": 8,
+    "num_services_cloud": 9,
+    "num_services_shadow": 10,
+}
+_RAW_SAMPLE_V3_0 = {
+    **_RAW_SAMPLE_V2_0,
+    "num_synthetic_tests": 11,
+    "num_synthetic_tests_excluded": 12,
+}
+
+_EXPECTED_SAMPLE_V1_0 = {
+    "instance_id": str(_INSTANCE_ID),
+    "site_hash": "site-hash",
+    "version": "version",
+    "edition": "edition",
+    "platform": "platform",
+    "is_cma": False,
+    "sample_time": 1,
+    "timezone": "timezone",
+    "num_hosts": 2,
+    "num_hosts_cloud": 0,
+    "num_hosts_shadow": 0,
+    "num_hosts_excluded": 0,
+    "num_services": 3,
+    "num_services_cloud": 0,
+    "num_services_shadow": 0,
+    "num_services_excluded": 0,
+    "num_synthetic_tests": 0,
+    "num_synthetic_tests_excluded": 0,
+    "extension_ntop": True,
+}
+_EXPECTED_SAMPLE_V1_1 = {
+    **_EXPECTED_SAMPLE_V1_0,
+    "num_hosts_excluded": 4,
+    "num_services_excluded": 5,
+}
+_EXPECTED_SAMPLE_V1_4 = {
+    **_EXPECTED_SAMPLE_V1_1,
+    "num_hosts_shadow": 6,
+}
+_EXPECTED_SAMPLE_V1_5 = {
+    **_EXPECTED_SAMPLE_V1_4,
+    "instance_id": _RAW_INSTANCE_ID,
+}
+_EXPECTED_SAMPLE_V2_0 = {
+    **_EXPECTED_SAMPLE_V1_1,
+    "instance_id": _RAW_INSTANCE_ID,
+    "num_hosts_cloud": 7,
+    "num_hosts_shadow": 8,
+    "num_services_cloud": 9,
+    "num_services_shadow": 10,
+}
+_EXPECTED_SAMPLE_V3_0 = {
+    **_EXPECTED_SAMPLE_V2_0,
+    "num_synthetic_tests": 11,
+    "num_synthetic_tests_excluded": 12,
+}
+
+
+@pytest.mark.parametrize(
+    "protocol_version, raw_sample, expected_raw_sample",
+    [
+        pytest.param("1.0", _RAW_SAMPLE_V1_0, _EXPECTED_SAMPLE_V1_0, id="1.0"),
+        pytest.param("1.1", _RAW_SAMPLE_V1_1, _EXPECTED_SAMPLE_V1_1, id="1.1"),
+        pytest.param("1.2", _RAW_SAMPLE_V1_1, _EXPECTED_SAMPLE_V1_1, id="1.2"),
+        pytest.param("1.3", _RAW_SAMPLE_V1_1, _EXPECTED_SAMPLE_V1_1, id="1.3"),
+        pytest.param("1.4", _RAW_SAMPLE_V1_4, _EXPECTED_SAMPLE_V1_4, id="1.4"),
+        pytest.param("1.5", _RAW_SAMPLE_V1_5, _EXPECTED_SAMPLE_V1_5, id="1.5"),
+        pytest.param("2.0", _RAW_SAMPLE_V2_0, _EXPECTED_SAMPLE_V2_0, id="2.0"),
+        pytest.param("2.1", _RAW_SAMPLE_V2_0, _EXPECTED_SAMPLE_V2_0, id="2.1"),
+        pytest.param("3.0", _RAW_SAMPLE_V3_0, _EXPECTED_SAMPLE_V3_0, id="3.0"),
+    ],
+)
+def test_parse_sample(
+    protocol_version: Literal["1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"],
+    raw_sample: Mapping[str, Any],
+    expected_raw_sample: Mapping[str, Any],
+) -> None:
+    assert (
+        make_parser(protocol_version).parse_sample(_INSTANCE_ID, "", dict(raw_sample)).for_report()
+        == expected_raw_sample
+    )
+
+
+@pytest.mark.parametrize(
+    "protocol_version, raw_sample",
+    [
+        pytest.param("1.5", _RAW_SAMPLE_V1_5, id="1.5"),
+        pytest.param("2.0", _RAW_SAMPLE_V2_0, id="2.0"),
+        pytest.param("2.1", _RAW_SAMPLE_V2_0, id="2.1"),
+        pytest.param("3.0", _RAW_SAMPLE_V3_0, id="3.0"),
+    ],
+)
+def test_parse_sample_no_instance_id(
+    protocol_version: Literal["1.5", "2.0", "2.1", "3.0"],
+    raw_sample: Mapping[str, Any],
+) -> None:
+    raw_sample = {k: v for k, v in raw_sample.items() if k != "instance_id"}
+    with pytest.raises(ValueError, match="No such instance ID"):
+        make_parser(protocol_version).parse_sample(_INSTANCE_ID, "", raw_sample)
+
+
+@pytest.mark.parametrize(
+    "protocol_version, raw_sample",
+    [
+        pytest.param("1.0", _RAW_SAMPLE_V1_0, id="1.0"),
+        pytest.param("1.1", _RAW_SAMPLE_V1_1, id="1.1"),
+        pytest.param("1.2", _RAW_SAMPLE_V1_1, id="1.2"),
+        pytest.param("1.3", _RAW_SAMPLE_V1_1, id="1.3"),
+        pytest.param("1.4", _RAW_SAMPLE_V1_4, id="1.4"),
+        pytest.param("1.5", _RAW_SAMPLE_V1_5, id="1.5"),
+        pytest.param("2.0", _RAW_SAMPLE_V2_0, id="2.0"),
+        pytest.param("2.1", _RAW_SAMPLE_V2_0, id="2.1"),
+        pytest.param("3.0", _RAW_SAMPLE_V3_0, id="3.0"),
+    ],
+)
+def test_parse_sample_no_site_hash(
+    protocol_version: Literal["1.0", "1.1", "1.2", "1.3", "1.4", "1.5", "2.0", "2.1", "3.0"],
+    raw_sample: Mapping[str, Any],
+) -> None:
+    raw_sample = {k: v for k, v in raw_sample.items() if k != "site_hash"}
+    with pytest.raises(ValueError, match="No such site hash"):
+        make_parser(protocol_version).parse_sample(_INSTANCE_ID, "", raw_sample)
+
+
 @pytest.mark.parametrize(
     "raw_sample, expected_ntop_enabled",
     [
@@ -484,3 +675,125 @@ def test_subscription_details_for_aggregation_for_report(
     expected_report: RawSubscriptionDetailsForAggregation,
 ) -> None:
     assert subscription_details.for_report() == expected_report
+
+
+_TZ = ZoneInfo("Europe/Berlin")
+
+
+def _timestamp(year: int, month: int, day: int, hour: int = 12) -> int:
+    return int(datetime(year, month, day, hour, tzinfo=_TZ).timestamp())
+
+
+def _daily_samples(start: date, end: date, num_services: int) -> list[tuple[int, int]]:
+    return [
+        (_timestamp(day.year, day.month, day.day), num_services)
+        for day in (start + timedelta(days=offset) for offset in range((end - start).days))
+    ]
+
+
+def test_monthly_service_averages_daily_services() -> None:
+    with time_machine.travel(datetime(2023, 6, 1, tzinfo=_TZ), tick=False):
+        aggregation = MonthlyServiceAverages(
+            SubscriptionDetailsForAggregation(None, None, None),
+            [
+                (_timestamp(2023, 1, 1, 1), 1),
+                (_timestamp(2023, 1, 1, 23), 2),
+                # Local midnight separates the days, not UTC midnight
+                (int(datetime(2023, 1, 1, 23, 30, tzinfo=ZoneInfo("UTC")).timestamp()), 4),
+                (_timestamp(2023, 1, 3), 8),
+            ],
+        ).get_aggregation()
+
+    assert aggregation["daily_services"] == [
+        {"sample_time": _timestamp(2023, 1, 1, 0), "num_services": 3},
+        {"sample_time": _timestamp(2023, 1, 2, 0), "num_services": 4},
+        {"sample_time": _timestamp(2023, 1, 3, 0), "num_services": 8},
+    ]
+    assert aggregation["monthly_service_averages"] == []
+
+
+def test_monthly_service_averages_daily_services_latest_400_days() -> None:
+    start = date(2022, 1, 1)
+    with time_machine.travel(datetime(2024, 1, 1, tzinfo=_TZ), tick=False):
+        daily_services = MonthlyServiceAverages(
+            SubscriptionDetailsForAggregation(None, None, None),
+            # Unordered input: latest days first
+            _daily_samples(start, start + timedelta(days=450), 1)[::-1],
+        ).get_aggregation()["daily_services"]
+
+    assert len(daily_services) == 400
+    assert daily_services[0]["sample_time"] == _timestamp(2022, 2, 20, 0)
+    assert daily_services[-1]["sample_time"] == _timestamp(2023, 3, 26, 0)
+
+
+def test_monthly_service_averages_skip_running_month() -> None:
+    samples = [
+        *_daily_samples(date(2023, 1, 1), date(2023, 1, 2), 40),
+        *_daily_samples(date(2023, 1, 2), date(2023, 2, 1), 9),
+        *_daily_samples(date(2023, 2, 1), date(2023, 3, 1), 20),
+        *_daily_samples(date(2023, 3, 1), date(2023, 4, 1), 30),
+        *_daily_samples(date(2023, 4, 1), date(2023, 4, 15), 100),
+    ]
+    with time_machine.travel(datetime(2023, 4, 15, tzinfo=_TZ), tick=False):
+        aggregation = MonthlyServiceAverages(
+            SubscriptionDetailsForAggregation(
+                _timestamp(2023, 1, 1, 8), _timestamp(2024, 1, 1, 8), 15
+            ),
+            samples,
+        ).get_aggregation()
+
+    # April is still running and thus skipped
+    assert aggregation["monthly_service_averages"] == [
+        {"sample_time": _timestamp(2023, 1, 1, 0), "num_services": 10.0},
+        {"sample_time": _timestamp(2023, 2, 1, 0), "num_services": 20.0},
+        {"sample_time": _timestamp(2023, 3, 1, 0), "num_services": 30.0},
+    ]
+    assert aggregation["last_service_report"] == {
+        "sample_time": _timestamp(2023, 3, 1, 0),
+        "num_services": 30.0,
+    }
+    assert aggregation["highest_service_report"] == {
+        "sample_time": _timestamp(2023, 3, 1, 0),
+        "num_services": 30.0,
+    }
+    assert aggregation["subscription_exceeded_first"] == {
+        "sample_time": _timestamp(2023, 2, 1, 0),
+        "num_services": 20.0,
+    }
+
+
+def test_monthly_service_averages_stop_at_subscription_end() -> None:
+    with time_machine.travel(datetime(2024, 1, 1, tzinfo=_TZ), tick=False):
+        aggregation = MonthlyServiceAverages(
+            SubscriptionDetailsForAggregation(
+                _timestamp(2023, 1, 1, 8), _timestamp(2023, 3, 1, 8), None
+            ),
+            _daily_samples(date(2023, 1, 1), date(2023, 6, 1), 10),
+        ).get_aggregation()
+
+    assert aggregation["monthly_service_averages"] == [
+        {"sample_time": _timestamp(2023, 1, 1, 0), "num_services": 10.0},
+        {"sample_time": _timestamp(2023, 2, 1, 0), "num_services": 10.0},
+    ]
+    assert aggregation["subscription_exceeded_first"] is None
+
+
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        pytest.param(None, 1, id="no-start"),
+        pytest.param(1, None, id="no-end"),
+    ],
+)
+def test_monthly_service_averages_no_subscription_period(
+    start: int | None, end: int | None
+) -> None:
+    aggregation = MonthlyServiceAverages(
+        SubscriptionDetailsForAggregation(start, end, None),
+        _daily_samples(date(2023, 1, 1), date(2023, 3, 1), 10),
+    ).get_aggregation()
+
+    assert len(aggregation["daily_services"]) == 59
+    assert aggregation["monthly_service_averages"] == []
+    assert aggregation["last_service_report"] is None
+    assert aggregation["highest_service_report"] is None